@@ -16,7 +16,7 @@
 import os
 import networkx as nx
 import FreeCAD as App
-from ..features import getResourcesDir, getRotationVal, getBaseVal
+from ..features import getResourcesDir, getPlacementVals, resolvePlacements
 
 
 class ConstraintSystemCmd:
@@ -64,28 +64,179 @@ class ConstraintSystem:
             print("No system object in assembly")
 
     @staticmethod
-    def updateSystem():
-        system = ConstraintSystem.getSystemObject()
+    def getEdge(f):
+        """
+        Returns the nodes u and v joined by the constraint f in the system and
+        a dictionary with the attributes of the constraint
+        """
+        u = None
+        v = None
+        if f.Type == "Lock_Constraint":
+            u = f.Object
+            v = "LOCK_NODE"
+        attrs = {
+            "weight": f.reduced_DoF,
+            "label": f.Name,
+            "parameters": f.Parameters,
+            "constraintType": f.Type,
+            "epoch": [f.ID, getattr(f, "edit_epoch", None)],
+        }
+        return u, v, attrs
+
+    @staticmethod
+    def _hasEdgeTable(systemData):
+        """
+        Returns True if systemData is an edge table (see updateSystem). Files
+        saved with older versions can store the system with another layout.
+        """
+        return isinstance(systemData, dict) and "epochs" in systemData
+
+    @staticmethod
+    def _setEdge(systemData, i, u, v, attrs):
+        systemData["u"][i] = u
+        systemData["v"][i] = v
+        systemData["weights"][i] = attrs["weight"]
+        systemData["labels"][i] = attrs["label"]
+        systemData["parameters"][i] = attrs["parameters"]
+        systemData["constraintTypes"][i] = attrs["constraintType"]
+        systemData["epochs"][i] = attrs["epoch"]
+
+    @staticmethod
+    def _updateNodes(systemData):
+        systemData["nodes"] = list(dict.fromkeys(systemData["u"]
+                                                 + systemData["v"]))
+
+    @staticmethod
+    def _addEdge(system, u, v, attrs):
+        """
+        Adds a new constraint to the data of the system object in place. The
+        change is not recorded by undo/redo and doesn't touch the system
+        object, so the data is only correct because updateSystem checks the
+        epochs before each solve and rebuilds it when they don't match.
+        """
+        systemData = system.System_Data
+        if not ConstraintSystem._hasEdgeTable(systemData):
+            return
+        for column in ("u", "v", "weights", "labels", "parameters",
+                       "constraintTypes", "epochs"):
+            systemData[column].append(None)
+        ConstraintSystem._setEdge(systemData, -1, u, v, attrs)
+        ConstraintSystem._updateNodes(systemData)
+
+    @staticmethod
+    def _updateEdge(system, u, v, attrs):
+        """
+        Updates the data of a constraint already in the system object in
+        place. Like _addEdge, it relies on the epoch check of updateSystem.
+        """
+        systemData = system.System_Data
+        if (not ConstraintSystem._hasEdgeTable(systemData)
+                or attrs["label"] not in systemData["labels"]):
+            return
+        i = systemData["labels"].index(attrs["label"])
+        ConstraintSystem._setEdge(systemData, i, u, v, attrs)
+        ConstraintSystem._updateNodes(systemData)
+
+    @staticmethod
+    def _removeEdge(system, label):
+        """
+        Removes a constraint from the data of the system object in place.
+        Like _addEdge, it relies on the epoch check of updateSystem.
+        """
+        systemData = system.System_Data
+        if (not ConstraintSystem._hasEdgeTable(systemData)
+                or label not in systemData["labels"]):
+            return
+        i = systemData["labels"].index(label)
+        for column in ("u", "v", "weights", "labels", "parameters",
+                       "constraintTypes", "epochs"):
+            del systemData[column][i]
+        ConstraintSystem._updateNodes(systemData)
+
+    @staticmethod
+    def _isUpToDate(systemData, constraints):
+        """
+        Checks whether the data of the system object matches the constraints
+        """
+        if not ConstraintSystem._hasEdgeTable(systemData):
+            return False
+        if systemData["labels"] != [f.Name for f in constraints]:
+            return False
+        for f, u, v, epoch in zip(constraints, systemData["u"],
+                                  systemData["v"], systemData["epochs"]):
+            fEpoch = [f.ID, getattr(f, "edit_epoch", None)]
+            if fEpoch[1] is None or epoch != fEpoch:
+                return False
+            lockEdge = (f.Object, "LOCK_NODE")
+            if f.Type == "Lock_Constraint" and (u, v) != lockEdge:
+                return False
+        return True
+
+    @staticmethod
+    def updateSystem(system=None):
+        """
+        Checks the data of the system object against all the constraints in
+        the assembly and rebuilds it when they don't match. The data is
+        normally kept up to date by the constraints themselves (see _addEdge,
+        _updateEdge and _removeEdge), but those changes are not recorded by
+        undo/redo, so this check is required to keep the data correct. The
+        system object is looked up when it is not given.
+        """
         if system is None:
+            system = ConstraintSystem.getSystemObject()
+            if system is None:
+                return
+        constraints = [f for f in App.ActiveDocument.Constraints.Group
+                       if f.Name != ConstraintSystem.name]
+        previousData = system.System_Data
+        if ConstraintSystem._isUpToDate(previousData, constraints):
             return
-        systemGraph = nx.MultiGraph()
-        for f in App.ActiveDocument.Constraints.Group:
-            if f.Name == ConstraintSystem.name:
-                continue
+        # The system is stored as an edge table: each constraint is an edge
+        # between the nodes u and v, and its attributes are stored at the same
+        # index of the other lists. The nodes of the system are also stored so
+        # they don't have to be computed again when reading the system.
+        # The epochs column stores the object ID and edit_epoch of each
+        # constraint. When they are the same as in the previous update, the
+        # constraint has not changed and its stored data is reused.
+        systemData = {
+            "nodes": [],
+            "u": [],
+            "v": [],
+            "weights": [],
+            "labels": [],
+            "parameters": [],
+            "constraintTypes": [],
+            "epochs": [],
+        }
+        previousRows = {}
+        if ConstraintSystem._hasEdgeTable(previousData):
+            previousRows = {label: i for i, label
+                            in enumerate(previousData["labels"])}
+        for f in constraints:
             u = None
             v = None
-            label = f.Name
-            weight = f.reduced_DoF
-            constraintData = f.Parameters
-            constraintType = f.Type
             if f.Type == "Lock_Constraint":
                 u = f.Object
                 v = "LOCK_NODE"
-            systemGraph.add_edge(u, v, weight=weight, label=label,
-                                 parameters=constraintData,
-                                 constraintType=constraintType)
+            epoch = [f.ID, getattr(f, "edit_epoch", None)]
+            i = previousRows.get(f.Name)
+            if (epoch[1] is not None and i is not None
+                    and previousData["epochs"][i] == epoch):
+                weight = previousData["weights"][i]
+                parameters = previousData["parameters"][i]
+            else:
+                weight = f.reduced_DoF
+                parameters = f.Parameters
+            systemData["u"].append(u)
+            systemData["v"].append(v)
+            systemData["weights"].append(weight)
+            systemData["labels"].append(f.Name)
+            systemData["parameters"].append(parameters)
+            systemData["constraintTypes"].append(f.Type)
+            systemData["epochs"].append(epoch)
+        ConstraintSystem._updateNodes(systemData)
 
-        system.System_Data = nx.to_dict_of_dicts(systemGraph)
+        system.System_Data = systemData
         # ConstraintSystem.addLinkedObject()
 
     # @staticmethod
@@ -113,68 +264,96 @@ class ConstraintSystem:
                     # system.System_Data = nx.to_dict_of_dicts(systemGraph)
 
     @staticmethod
-    def getObjects():
+    def getSystemData(system=None):
         """
-        Returns a dictionary containing all the names of all objects in the
-        system with their position and rotation values
+        Returns the edge table stored in the system object (see updateSystem).
+        The system object is looked up when it is not given.
         """
-        system = ConstraintSystem.getSystemObject()
         if system is None:
-            return
-        systemGraph = nx.from_dict_of_dicts(system.System_Data)
+            system = ConstraintSystem.getSystemObject()
+            if system is None:
+                return
+        return system.System_Data
+
+    @staticmethod
+    def getObjects(systemData, objectMap=None, placementCache=None):
+        """
+        Returns a dictionary containing all the names of all objects in the
+        system with their position and rotation values. objectMap and
+        placementCache are passed to resolvePlacements in order to avoid
+        looking up the objects in the document and resolving their placements
+        more than once per solve.
+        """
+        if placementCache is None:
+            placementCache = {}
+        objNames = [objName for objName in systemData["nodes"]
+                    if objName != "LOCK_NODE"]
+        # all the placements are resolved together before reading them
+        resolvePlacements(objNames, placementCache, objectMap)
         objects = {}
-        for objName in systemGraph.nodes:
-            if objName == "LOCK_NODE":
-                continue
-            objects[objName] = {}
-            objects[objName]["x"] = getBaseVal(objName, "x")
-            objects[objName]["y"] = getBaseVal(objName, "y")
-            objects[objName]["z"] = getBaseVal(objName, "z")
-            objects[objName]["phi"] = getRotationVal(objName, "x")
-            objects[objName]["theta"] = getRotationVal(objName, "y")
-            objects[objName]["psi"] = getRotationVal(objName, "z")
+        for objName in objNames:
+            # the values were cached by resolvePlacements
+            x, y, z, phi, theta, psi = getPlacementVals(objName,
+                                                        placementCache)
+            objects[objName] = {
+                "x": x,
+                "y": y,
+                "z": z,
+                "phi": phi,
+                "theta": theta,
+                "psi": psi,
+            }
         return objects
 
     @staticmethod
-    def getConstraintNames():
+    def getConstraintData(systemData):
         """
-        Returns a dictionary containing all the names of of the constraints in
-        the system and the respective objects they constraint
+        Returns two dictionaries: the first one contains all the names of the
+        constraints in the system and the respective objects they constraint,
+        the second one contains all the parameters of those constraints.
         """
-        system = ConstraintSystem.getSystemObject()
-        if system is None:
-            return
-        systemGraph = nx.from_dict_of_dicts(system.System_Data,
-                                            multigraph_input=True,
-                                            create_using=nx.MultiGraph)
         constraintNames = {}
-        for obj1Name, obj2Name, data in systemGraph.edges(data=True):
-            if data["constraintType"] == "Lock_Constraint":
-                fName = data["label"]
+        constraintParameters = {}
+        for obj1Name, obj2Name, fName, fType, params in zip(
+                systemData["u"], systemData["v"], systemData["labels"],
+                systemData["constraintTypes"], systemData["parameters"]):
+            if fType == "Lock_Constraint":
                 objName = None
                 if obj1Name == "LOCK_NODE":
                     objName = obj2Name
                 else:
                     objName = obj1Name
                 constraintNames[fName] = {"Object": objName}
-        return constraintNames
+                constraintParameters[fName] = params
+        return constraintNames, constraintParameters
 
     @staticmethod
-    def getConstraintParameters():
+    def getSubsystems(objects, constraintNames, constraintParams):
         """
-        Returns a dictionary containing all the parameters of the constraints
-        in the system.
+        Splits the system into independent subsystems. The objects of a
+        subsystem are not related by any constraint to the objects of the other
+        subsystems, so each subsystem can be solved separately. Returns a list
+        with the (objects, constraintNames, constraintParams) of each
+        subsystem, in the same format given by getObjects and
+        getConstraintData.
         """
-        system = ConstraintSystem.getSystemObject()
-        if system is None:
-            return
-        systemGraph = nx.from_dict_of_dicts(system.System_Data,
-                                            multigraph_input=True,
-                                            create_using=nx.MultiGraph)
-        constraintParameters = {}
-        for _, _, data in systemGraph.edges(data=True):
-            if data["constraintType"] == "Lock_Constraint":
-                fName = data["label"]
-                constraintParameters[fName] = data["parameters"]
+        graph = nx.Graph()
+        graph.add_nodes_from(objects)
+        for objectNames in constraintNames.values():
+            names = list(objectNames.values())
+            graph.add_edges_from(zip(names, names[1:]))
+        components = list(nx.connected_components(graph))
+        componentIdx = {}
+        for i, component in enumerate(components):
+            for objName in component:
+                componentIdx[objName] = i
 
-        return constraintParameters
+        subsystems = [({}, {}, {}) for _ in components]
+        for objName, vals in objects.items():
+            subsystems[componentIdx[objName]][0][objName] = vals
+        for fName, objectNames in constraintNames.items():
+            objName = next(iter(objectNames.values()))
+            _, subNames, subParams = subsystems[componentIdx[objName]]
+            subNames[fName] = objectNames
+            subParams[fName] = constraintParams[fName]
+        return subsystems
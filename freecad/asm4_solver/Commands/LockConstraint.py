@@ -15,7 +15,7 @@
 
 import os
 from math import pi
-from PySide import QtGui
+from PySide import QtCore, QtGui
 import FreeCAD as App
 import FreeCADGui as Gui
 import libAsm4 as asm4
@@ -23,6 +23,24 @@ from ..features import getResourcesDir
 from .ConstraintSystem import ConstraintSystem
 
 
+# Set of the datum types that can be locked
+_DATUM_TYPES = frozenset(asm4.datumTypes)
+
+_DEG2RAD = pi/180
+
+# Maps each variable of a lock constraint to the property that enables it, the
+# property holding its value and whether the value is a rotation (the rotation
+# values are shown in degrees but stored in radians)
+_VAR_TO_PROPS = {
+    "x": ("Base_x", "Base_x_val", False),
+    "y": ("Base_y", "Base_y_val", False),
+    "z": ("Base_z", "Base_z_val", False),
+    "phi": ("Rotation_x", "Rotation_x_val", True),
+    "theta": ("Rotation_y", "Rotation_y_val", True),
+    "psi": ("Rotation_z", "Rotation_z_val", True),
+}
+
+
 class LockConstraintCmd:
 
     def GetResources(self):
@@ -79,22 +97,44 @@ class LockPanel:
             value = qty(self.form.zrotVal.text()).Value
             constraint_params["psi"] = value
 
-        newConstraint = App.ActiveDocument.addObject("App::FeaturePython", self.type)
-        LockConstraint(newConstraint, objName, self.type, constraint_params)
+        # All the changes of the new constraint are grouped in one transaction
+        App.ActiveDocument.openTransaction("Add Lock constraint")
+        try:
+            newConstraint = App.ActiveDocument.addObject("App::FeaturePython",
+                                                         self.type)
+            LockConstraint(newConstraint, objName, self.type,
+                           constraint_params)
+        except Exception:
+            App.ActiveDocument.abortTransaction()
+            raise
+        App.ActiveDocument.commitTransaction()
         Gui.Control.closeDialog()
         App.ActiveDocument.recompute()
 
     def addObjects(self):
+        datumItems = []
         for obj in App.ActiveDocument.Objects:
-            if obj.TypeId not in asm4.datumTypes:
+            if obj.TypeId not in _DATUM_TYPES:
                 continue
             newItem = QtGui.QListWidgetItem()
             newItem.setText(obj.Name)
-            newItem.setIcon(obj.ViewObject.Icon)
             self.form.objectList.addItem(newItem)
+            datumItems.append((newItem, obj))
+        # Getting the icons is slow, so they are added once the dialog is
+        # shown in order to display the list immediately
+        QtCore.QTimer.singleShot(0, lambda: self.addIcons(datumItems))
+
+    @staticmethod
+    def addIcons(datumItems):
+        for item, obj in datumItems:
+            item.setIcon(obj.ViewObject.Icon)
 
 
 class LockConstraint:
+    # Properties that change the parameters of the constraint
+    _WATCHED_PROPS = frozenset(prop for props in _VAR_TO_PROPS.values()
+                               for prop in props[:2])
+
     def __init__(self, obj, objName, constraintType, constraint_params):
         obj.Proxy = self
         obj.addProperty("App::PropertyString", "Type", "", "", 1)
@@ -116,61 +156,60 @@ class LockConstraint:
         obj.addProperty("App::PropertyFloat", "Rotation_z_val", "Placement")
         obj.addProperty("App::PropertyPythonObject", "Parameters", "", "", 4)
         obj.Parameters = constraint_params
-        for variable in constraint_params:
-            val = constraint_params[variable]
-            # Name of the property to put the value
-            if variable == "x":
-                setattr(obj, "Base_x", True)
-                setattr(obj, "Base_x_val", val)
-            if variable == "y":
-                setattr(obj, "Base_y", True)
-                setattr(obj, "Base_y_val", val)
-            if variable == "z":
-                setattr(obj, "Base_z", True)
-                setattr(obj, "Base_z_val", val)
-            if variable == "phi":
-                setattr(obj, "Rotation_x", True)
-                setattr(obj, "Rotation_x_val", val)
-            if variable == "theta":
-                setattr(obj, "Rotation_y", True)
-                setattr(obj, "Rotation_y_val", val)
-            if variable == "psi":
-                setattr(obj, "Rotation_z", True)
-                setattr(obj, "Rotation_z_val", val)
+        # Incremented each time the parameters change, used by the system
+        # object to know when the constraint data has to be read again
+        obj.addProperty("App::PropertyInteger", "edit_epoch", "", "", 4)
+        for variable, val in list(constraint_params.items()):
+            # Name of the properties to enable the variable and put the value
+            enableProp, valueProp, _ = _VAR_TO_PROPS[variable]
+            setattr(obj, enableProp, True)
+            setattr(obj, valueProp, val)
         App.ActiveDocument.Constraints.addObject(obj)
+        system = obj.Document.getObject(ConstraintSystem.name)
+        if system is not None:
+            ConstraintSystem._addEdge(system, *ConstraintSystem.getEdge(obj))
 
     def onChanged(self, obj, prop):
-        if prop in "Base_x_val":
-            self.changeParameterValue(obj, "x", "Base_x")
-        if prop in "Base_y_val":
-            self.changeParameterValue(obj, "y", "Base_y")
-        if prop in "Base_z_val":
-            self.changeParameterValue(obj, "z", "Base_z")
-        if prop in "Rotation_x_val":
-            self.changeParameterValue(obj, "phi", "Rotation_x")
-        if prop in ("Rotation_y", "Rotation_y_val"):
-            self.changeParameterValue(obj, "theta", "Rotation_y")
-        if prop in "Rotation_z_val":
-            self.changeParameterValue(obj, "psi", "Rotation_z")
+        if prop in self._WATCHED_PROPS:
+            self.changeParameterValue(obj)
+
+    def unsetupObject(self, obj):
+        # The constraint is being removed from the document
+        system = obj.Document.getObject(ConstraintSystem.name)
+        if system is not None:
+            ConstraintSystem._removeEdge(system, obj.Name)
 
     @staticmethod
-    def changeParameterValue(obj, param, prop):
-        valueProp = prop + "_val"
+    def changeParameterValue(obj):
         # When loading the document the object properties are touched;
         # however, not all the properties are loaded yet which gives
         # errors related to the object not having a property. So we
-        # do nothing if the valueProp has not being loaded yet.
+        # do nothing if some property has not being loaded yet.
         # The information about the fix constraint value is already
         # in the dictionary when loading the object.
-        if not hasattr(obj, valueProp) or not hasattr(obj, "reduced_DoF"):
+        if (not hasattr(obj, "Parameters") or not hasattr(obj, "reduced_DoF")
+                or not all(hasattr(obj, valueProp)
+                           for _, valueProp, _ in _VAR_TO_PROPS.values())):
             return
 
-        if not getattr(obj, prop):
-            obj.Parameters.pop(param, None)
-        else:
+        # The parameters are built again from all the properties and assigned
+        # at once instead of changing the stored dictionary item by item
+        parameters = {}
+        for param, (prop, valueProp, isRotation) in _VAR_TO_PROPS.items():
+            if not getattr(obj, prop):
+                continue
             val = getattr(obj, valueProp)
-            if "Rotation" in prop:
-                val = val*pi/180
-            obj.Parameters[param] = val
+            if isRotation:
+                val = val*_DEG2RAD
+            parameters[param] = val
+        obj.Parameters = parameters
         # update the reduced degrees of freedom from this constraint
-        obj.reduced_DoF = len(obj.Parameters)
+        obj.reduced_DoF = len(parameters)
+        # documents created before edit_epoch was added don't have it
+        if hasattr(obj, "edit_epoch"):
+            obj.edit_epoch += 1
+        # update the data of this constraint in the system object
+        system = obj.Document.getObject(ConstraintSystem.name)
+        if system is not None:
+            edge = ConstraintSystem.getEdge(obj)
+            ConstraintSystem._updateEdge(system, *edge)
@@ -15,13 +15,40 @@
 
 import os
 import time
-from math import pi
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import FreeCAD as App
-from asm4_solver.solver import solve_constraint_system
-from ..features import getResourcesDir
+from ..features import getResourcesDir, getObjectMap, eulerToQuaternions
 from .ConstraintSystem import ConstraintSystem as CS
 
 
+# Solved placements closer than this to the current ones are not written
+_WRITE_TOLERANCE = 1e-9
+# Prints the time used by each solve when enabled in the preferences
+_DEBUG_TIMING = App.ParamGet(
+    "User parameter:BaseApp/Preferences/Mod/Asm4Solver").GetBool(
+        "DebugTiming", False)
+
+
+def solveLocks(objects, constraintNames, constraintParams):
+    """
+    Solves a system that only contains lock constraints. A lock constraint
+    just sets the locked variables to their values, so the result is obtained
+    directly without running the solver.
+
+    The result is returned like solve_constraint_system does: the names of the
+    objects, their (x, y, z) positions, their (phi, theta, psi) angles, and
+    whether the system was solved.
+    """
+    for fName, objectNames in constraintNames.items():
+        objects[objectNames["Object"]].update(constraintParams[fName])
+    names = list(objects)
+    bases = [(vals["x"], vals["y"], vals["z"]) for vals in objects.values()]
+    eulers = [(vals["phi"], vals["theta"], vals["psi"])
+              for vals in objects.values()]
+    return names, bases, eulers, True
+
+
 class SolveSystemCmd:
     def GetResources(self):
         return {
@@ -38,29 +65,99 @@ class SolveSystemCmd:
             return (False)
 
     def Activated(self):
-        t = time.time()
+        t = time.perf_counter()
         App.Console.PrintMessage("Solving the system...")
-        CS.updateSystem()
-        objects = CS.getObjects()
-        constraintNames = CS.getConstraintNames()
-        constraintParams = CS.getConstraintParameters()
-        new_objects, success = solve_constraint_system(objects,
+        system = CS.getSystemObject()
+        if system is None:
+            return
+        CS.updateSystem(system)
+        systemData = CS.getSystemData(system)
+        objectMap = getObjectMap()
+        # the placements resolved during this solve
+        placementCache = {}
+        objects = CS.getObjects(systemData, objectMap, placementCache)
+        constraintNames, constraintParams = CS.getConstraintData(systemData)
+        if all(fType == "Lock_Constraint"
+               for fType in systemData["constraintTypes"]):
+            names, bases, eulers, success = solveLocks(objects,
                                                        constraintNames,
                                                        constraintParams)
+        else:
+            # The solver extension is only loaded when it is needed. Systems
+            # with only lock constraints can still be solved without it.
+            try:
+                from asm4_solver.solver import solve_constraint_system
+            except ImportError as e:
+                App.Console.PrintError("The solver extension could not be "
+                                       f"loaded ({e}), only systems with lock "
+                                       "constraints can be solved\n")
+                return
+            # The independent parts of the system are solved in parallel.
+            # Threads are enough since the solver releases the GIL.
+            subsystems = CS.getSubsystems(objects, constraintNames,
+                                          constraintParams)
+            results = [None]*len(subsystems)
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                futures = {executor.submit(solve_constraint_system,
+                                           *subsystem): i
+                           for i, subsystem in enumerate(subsystems)}
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+            # the results are merged in the order of the subsystems
+            names = []
+            bases = []
+            eulers = []
+            success = True
+            for subNames, subBases, subEulers, subSuccess in results:
+                names.extend(subNames)
+                bases.extend(subBases)
+                eulers.extend(subEulers)
+                success = success and subSuccess
         if not success:
             App.Console.PrintError("Couldn't solve the system!")
             return
 
-        for objName, new_vals in new_objects.items():
-            obj = App.ActiveDocument.getObject(objName)
-            obj.Placement.Base.x = new_vals["x"]
-            obj.Placement.Base.y = new_vals["y"]
-            obj.Placement.Base.z = new_vals["z"]
-            newRotation = App.Rotation(new_vals["psi"]*180/pi,
-                                       new_vals["theta"]*180/pi,
-                                       new_vals["phi"]*180/pi)
-            obj.Placement.Rotation = newRotation
+        bases = np.asarray(bases, dtype=np.float64).reshape(-1, 3)
+        # The rotations of all the objects are converted to quaternions at
+        # once, which avoids the conversion done by App.Rotation for each
+        # object when it is built from Euler angles
+        quaternions = eulerToQuaternions(eulers)
+        # Assigning a placement notifies the document even when the value
+        # does not change, so only the objects that moved are written. The
+        # current values are stored as (x, y, z, qx, qy, qz, qw).
+        objs = [objectMap[objName] for objName in names]
+        placements = [obj.Placement for obj in objs]
+        current = np.array([(*pla.Base, *pla.Rotation.Q)
+                            for pla in placements],
+                           dtype=np.float64).reshape(-1, 7)
+        baseDelta = np.abs(bases - current[:, :3]).max(axis=1)
+        # q and -q represent the same rotation
+        rotationDelta = np.minimum(
+            np.abs(quaternions - current[:, 3:]).max(axis=1),
+            np.abs(quaternions + current[:, 3:]).max(axis=1))
+        changed = np.maximum(baseDelta, rotationDelta) >= _WRITE_TOLERANCE
+        touched = []
+        for i in np.flatnonzero(changed):
+            newBase = App.Vector(*bases[i])
+            newRotation = App.Rotation(*quaternions[i])
+            # The whole placement is assigned at once
+            objs[i].Placement = App.Placement(newBase, newRotation)
+            touched.append(objs[i])
         App.Console.PrintMessage("Solved the system successfully!")
-        App.ActiveDocument.recompute()
-        timeUsed = time.time() - t
-        print(f"solver took {timeUsed}")
+        # Document.recompute(objs) only recomputes objs and the objects they
+        # depend on, so the objects depending on the moved ones are added to
+        # the list. The constraints and the system object edited before the
+        # solve are also recomputed when they are touched.
+        toRecompute = {}
+        for obj in touched:
+            toRecompute[obj.Name] = obj
+            for dependent in obj.InListRecursive:
+                toRecompute[dependent.Name] = dependent
+        for f in App.ActiveDocument.Constraints.Group:
+            if f.isTouched():
+                toRecompute[f.Name] = f
+        if toRecompute:
+            App.ActiveDocument.recompute(list(toRecompute.values()), True)
+        if _DEBUG_TIMING:
+            timeUsed = time.perf_counter() - t
+            App.Console.PrintMessage(f"solver took {timeUsed:.4f}s\n")
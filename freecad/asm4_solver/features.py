@@ -15,62 +15,127 @@
 
 import os
 from math import pi
+import numpy as np
 import FreeCAD as App
 
 
+_RESOURCES_DIR = os.path.join(os.path.dirname(__file__), "Resources")
+_TWO_PI = 2*pi
+
+
 def getResourcesDir():
     """Returns the directory of the icon folder"""
-    return os.path.join(os.path.dirname(__file__), "Resources")
+    return _RESOURCES_DIR
 
 
-def getRotationVal(objName, axis):
+def getObjectMap():
     """
-    Gets an axis from the Rotation placement of an object in the current file
-    or from a child datum of a linked object
+    Returns a dictionary with all the objects in the current file indexed by
+    their names. It is meant to be built once and reused for many lookups.
     """
-    rot = None
-    val = None
-    if "." in objName:
-        parent, datum = objName.split(".")
-        linkedObject = App.ActiveDocument.getObject(parent).getLinkedObject()
-
-        parentPla = App.ActiveDocument.getObject(parent).Placement
-        datumPla = linkedObject.Document.getObject(datum).Placement
-        absDatumPla = parentPla*datumPla
-        rot = absDatumPla.Rotation.toEuler()
-    else:
-        rot = App.ActiveDocument.getObject(objName) \
-                                .Placement.Rotation.toEuler()
+    return {obj.Name: obj for obj in App.ActiveDocument.Objects}
 
-    if axis == "x":
-        val = rot[2] * pi/180
-    elif axis == "y":
-        val = rot[1] * pi/180
-    elif axis == "z":
-        val = rot[0] * pi/180
 
-    # We mostly prefer positive angles
-    if val < 0:
-        val = 2*pi + val
+def getPlacementVals(objName, placementCache=None, objectMap=None):
+    """
+    Returns the values (x, y, z, phi, theta, psi) of the absolute placement of
+    an object in the current file or of a child datum of a linked object.
+    placementCache is a dictionary where the resolved values are stored; it
+    should be created once per solve and passed to all the queries of that
+    solve (see resolvePlacements).
+    """
+    if placementCache is None:
+        placementCache = {}
+    if objName not in placementCache:
+        resolvePlacements([objName], placementCache, objectMap)
+    return placementCache[objName]
 
-    return val
 
+def matricesToEuler(rotations):
+    """
+    Returns the rotation angles (phi, theta, psi) in radians of a stack of
+    rotation matrices with shape (K, 3, 3). The angles follow the convention
+    of Rotation.toEuler (R = Rz(psi)*Ry(theta)*Rx(phi)) and are mapped to
+    [0, 2*pi).
+    """
+    cosTheta = np.hypot(rotations[:, 0, 0], rotations[:, 1, 0])
+    theta = np.arctan2(-rotations[:, 2, 0], cosTheta)
+    psi = np.arctan2(rotations[:, 1, 0], rotations[:, 0, 0])
+    phi = np.arctan2(rotations[:, 2, 1], rotations[:, 2, 2])
+    # At theta = +-pi/2 only phi -+ psi is defined, so psi is set to zero and
+    # the whole angle is given to phi like Rotation.toEuler does
+    gimbalLock = np.isclose(cosTheta, 0.0)
+    phi = np.where(gimbalLock,
+                   np.arctan2(-rotations[:, 1, 2], rotations[:, 1, 1]), phi)
+    psi = np.where(gimbalLock, 0.0, psi)
+    return np.mod(np.stack((phi, theta, psi), axis=-1), _TWO_PI)
 
-def getBaseVal(objName, axis):
+
+def eulerToQuaternions(eulers):
+    """
+    Returns the quaternions (x, y, z, w) with shape (K, 4) of a stack of
+    rotation angles (phi, theta, psi) in radians with shape (K, 3). The angles
+    follow the same convention as matricesToEuler. The quaternions are in the
+    order used by the quaternion constructor of App.Rotation.
+    """
+    half = np.asarray(eulers, dtype=np.float64).reshape(-1, 3) / 2
+    c = np.cos(half)
+    s = np.sin(half)
+    cPhi, cTheta, cPsi = c[:, 0], c[:, 1], c[:, 2]
+    sPhi, sTheta, sPsi = s[:, 0], s[:, 1], s[:, 2]
+    return np.stack((sPhi*cTheta*cPsi - cPhi*sTheta*sPsi,
+                     cPhi*sTheta*cPsi + sPhi*cTheta*sPsi,
+                     cPhi*cTheta*sPsi - sPhi*sTheta*cPsi,
+                     cPhi*cTheta*cPsi + sPhi*sTheta*sPsi), axis=-1)
+
+
+def resolvePlacements(objNames, placementCache, objectMap=None):
     """
-    Gets an axis from the Base placement of an object in the current file
-    or from a child datum of a linked object
+    Resolves the absolute placements of many objects at once and stores their
+    values in placementCache (see getPlacementVals). The objects already in
+    placementCache are skipped. All the datums of a linked object are
+    transformed by the placement of their parent with a single matrix product.
     """
-    val = None
-    if "." in objName:
-        parent, datum = objName.split(".")
-        linkedObject = App.ActiveDocument.getObject(parent).getLinkedObject()
-
-        parentPla = App.ActiveDocument.getObject(parent).Placement
-        datumPla = linkedObject.Document.getObject(datum).Placement
-        absDatumPla = parentPla*datumPla
-        val = getattr(absDatumPla.Base, axis)
+    if objectMap is None:
+        getObject = App.ActiveDocument.getObject
     else:
-        val = getattr(App.ActiveDocument.getObject(objName)
-                      .Placement.Base, axis)
-    return val
+        getObject = objectMap.get
+    # Placements grouped by the parent object they are relative to. The
+    # objects in the current file are in the group None.
+    groups = {}
+    for objName in objNames:
+        if objName in placementCache:
+            continue
+        if "." in objName:
+            parent, datum = objName.split(".")
+            if parent not in groups:
+                parentObject = getObject(parent)
+                groups[parent] = (parentObject,
+                                  parentObject.getLinkedObject().Document, [])
+            _, linkedDocument, members = groups[parent]
+            placement = linkedDocument.getObject(datum).Placement
+        else:
+            if None not in groups:
+                groups[None] = (None, None, [])
+            members = groups[None][2]
+            placement = getObject(objName).Placement
+        members.append((objName, placement))
+    if not groups:
+        return
+
+    names = []
+    matrices = []
+    for parentObject, _, members in groups.values():
+        mats = np.array([placement.Matrix.A for _, placement in members],
+                        dtype=np.float64).reshape(-1, 4, 4)
+        if parentObject is not None:
+            parentMat = np.array(parentObject.Placement.Matrix.A,
+                                 dtype=np.float64).reshape(4, 4)
+            mats = parentMat @ mats
+        names.extend(objName for objName, _ in members)
+        matrices.append(mats)
+    absMatrices = np.concatenate(matrices)
+    bases = absMatrices[:, :3, 3]
+    angles = matricesToEuler(absMatrices[:, :3, :3])
+    for objName, base, angle in zip(names, bases.tolist(), angles.tolist()):
+        placementCache[objName] = tuple(base) + tuple(angle)
@@ -1,10 +1,21 @@
+import os
 from setuptools import setup
 from setuptools_rust import RustExtension
 
 
+# Opt-in build for local installs (ASM4_NATIVE=1): the solver is optimized for
+# the CPU of this machine and the wheel uses the stable ABI (abi3) so it keeps
+# working after upgrading the Python version of FreeCAD.
+options = {}
+if os.environ.get("ASM4_NATIVE") == "1":
+    os.environ["RUSTFLAGS"] = " ".join(
+        filter(None, [os.environ.get("RUSTFLAGS"), "-C target-cpu=native"]))
+    options["bdist_wheel"] = {"py_limited_api": "cp36"}
+
 setup(name="asm4_solver",
       version="0.6.0",
-      rust_extensions=[RustExtension("asm4_solver.solver")],
+      rust_extensions=[RustExtension("asm4_solver.solver", debug=False,
+                                     py_limited_api="auto")],
       packages=["freecad",
                 "freecad.asm4_solver",
                 "freecad.asm4_solver.Commands",
@@ -13,5 +24,6 @@ setup(name="asm4_solver",
       url="https://github.com/Alonso-JAMM/Assembly4_Solver",
       description="Solver for Assembly4",
       install_requires=["numpy", "networkx"],
+      options=options,
       include_package_data=True,
       zip_safe=False)
@@ -39,18 +39,36 @@ fn solver(_py: Python<'_>, m: &PyModule) -> PyResult<()> {
 /// Set-up the constraints functions
 ///
 /// objects: map of all objects in the system with their current placement values.
-///     This map is returned with the resulting values after solving the system.
 /// constraint_names: map of all constraints with the name of constrained objects
 /// constraint_parameters: map of all constraints parameters. For example the
 ///     values of the axis to lock for a Lock constraint. Axis not enabled in a
 ///     constraint will be omitted in this map (if a lock constraint does not
 ///     lock the x-axis, then it will not be included in constraint_parameters)
+///
+/// Returns the resulting values after solving the system as parallel arrays:
+/// the names of the objects, their (x, y, z) positions, their (phi, theta, psi)
+/// rotation angles, and whether the solver succeeded.
+///
+/// The GIL is released while the system is solved, so independent systems can
+/// be solved in parallel from different Python threads.
 #[pyfunction]
 fn solve_constraint_system<'a>(
-    mut objects: HashMap<&'a str, HashMap<&'a str, f64>>,
+    py: Python<'_>,
+    objects: HashMap<&'a str, HashMap<&'a str, f64>>,
+    constraint_names: HashMap<&'a str, HashMap<&'a str, &str>>,
+    constraint_parameters: HashMap<&'a str, HashMap<&'a str, f64>>,
+) -> (Vec<&'a str>, Vec<(f64, f64, f64)>, Vec<(f64, f64, f64)>, bool) {
+    py.allow_threads(move || {
+        solve_system(objects, constraint_names, constraint_parameters)
+    })
+}
+
+/// Solves the system without holding the GIL (see solve_constraint_system)
+fn solve_system<'a>(
+    objects: HashMap<&'a str, HashMap<&'a str, f64>>,
     constraint_names: HashMap<&'a str, HashMap<&'a str, &str>>,
     constraint_parameters: HashMap<&'a str, HashMap<&'a str, f64>>,
-) -> (HashMap<&'a str, HashMap<&'a str, f64>>, bool) {
+) -> (Vec<&'a str>, Vec<(f64, f64, f64)>, Vec<(f64, f64, f64)>, bool) {
     // Here we store the system information.
     let mut system = System::new();
 
@@ -152,16 +170,25 @@ fn solve_constraint_system<'a>(
 //         println!("solution x: {}", sol.x);
 
 
+        let mut names = Vec::with_capacity(objects.len());
+        let mut bases = Vec::with_capacity(objects.len());
+        let mut eulers = Vec::with_capacity(objects.len());
         let mut obj_idx: usize;
         let mut sys_object: &system_object::SystemObject;
-        let mut var_name: VN;
-        for (obj, vars) in objects.iter_mut() {
+        for obj in objects.keys() {
             obj_idx = *system.sys_objects_idx.get(obj).unwrap();
             sys_object = &system.sys_objects[obj_idx];
-            for (var_name_str, var_value ) in vars.iter_mut() {
-                var_name = VN::get_from_str(var_name_str);
-                *var_value = sys_object.get_variable(var_name).value;
-            }
+            names.push(*obj);
+            bases.push((
+                sys_object.get_variable(VN::x).value,
+                sys_object.get_variable(VN::y).value,
+                sys_object.get_variable(VN::z).value,
+            ));
+            eulers.push((
+                sys_object.get_variable(VN::phi).value,
+                sys_object.get_variable(VN::theta).value,
+                sys_object.get_variable(VN::psi).value,
+            ));
         }
-        (objects, sol.success)
+        (names, bases, eulers, sol.success)
 }